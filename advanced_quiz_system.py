@@ -2,12 +2,116 @@
 # Page name: advanced_quiz_system.py
 # Page purpose: Advanced Quiz System generator for app.py
 # Date of creation: 2025-10-10
+import functools
+import itertools
 import json
 import re
+from collections import Counter
 from datetime import datetime
 from typing import Any, Dict, List, Optional, Union
 import streamlit as st
 
+try:
+    import orjson
+    _json_loads = orjson.loads
+
+    def _json_dumps(obj) -> str:
+        return orjson.dumps(obj).decode("utf-8")
+except ImportError:
+    _json_loads = json.loads
+    _json_dumps = json.dumps
+
+# Precompiled patterns for cleaning model output and parsing answers
+_RE_FENCE_START = re.compile(r"^```(?:json)?\s*", re.IGNORECASE)
+_RE_FENCE_END = re.compile(r"```\s*$", re.IGNORECASE)
+_RE_BSLASH = re.compile(r'\\(?!["\\/bfnrtu])')
+_RE_TRAIL_COMMA = re.compile(r",\s*([}\]])")
+_RE_TF = re.compile(r"\b(true|false)\b", re.IGNORECASE)
+_RE_MC_OPTS = re.compile(r"(?:^|\s)[A-D]\)\s*([^;|\n]+)")
+_RE_LETTER = re.compile(r"[A-Z]", re.IGNORECASE)
+_RE_MC_LEAD = re.compile(r"([A-Da-d])\b")
+_RE_ANSWER_LETTER = re.compile(r'^([A-Za-z])[\)\.]?\s*')
+_RE_WORD = re.compile(r"\w+")
+
+_QUESTION_TYPES = frozenset({"multiple_choice", "true_false", "short_answer", "mixed"})
+_TRUE_SET = frozenset({"a) true", "true", "t", "yes", "y", "1"})
+_FALSE_SET = frozenset({"b) false", "false", "f", "no", "n", "0"})
+_LETTERS = tuple(chr(ord('A') + i) for i in range(26))
+# Filler words a short answer may add or drop without changing its meaning (no negations)
+_SHORT_ANSWER_STOPWORDS = frozenset({
+    "a", "an", "the", "of", "to", "in", "on", "at", "for", "by", "with", "and",
+    "is", "are", "was", "were", "be", "been", "it", "its", "this", "that", "these",
+    "those", "as", "from", "which", "who", "their", "there",
+})
+
+# Smart quotes -> ASCII quotes and control characters (except tab/LF/CR) -> space, in one pass
+_CLEAN_TRANSLATE_TBL = str.maketrans({
+    "\u201c": '"', "\u201d": '"', "\u2018": "'", "\u2019": "'",
+    **{c: " " for c in [*range(0, 9), 11, 12, *range(14, 32)]}
+})
+
+# Option strings repeat on every rerun, so the letter lookup is memoized
+@functools.lru_cache(maxsize=512)
+def _extract_answer_letter(answer: str) -> str:
+    match = _RE_ANSWER_LETTER.match(answer.strip())
+    return match.group(1).upper() if match else ""
+
+# Quiz history stats in one pass, cached across reruns on a (score, difficulty, type) snapshot
+@st.cache_data(show_spinner=False)
+def _summarize_quiz_sessions(snapshot: tuple) -> Dict[str, Any]:
+    score_sum = 0.0
+    best_score = float('-inf')
+    difficulties = set()
+    question_types = set()
+    for score, difficulty, question_type in snapshot:
+        score_sum += score
+        if score > best_score:
+            best_score = score
+        difficulties.add(difficulty)
+        question_types.add(question_type)
+    avg_score = score_sum / len(snapshot)
+    return {
+        'total': len(snapshot),
+        'avg_score': avg_score,
+        'best_score': best_score,
+        'difficulties': sorted(difficulties),
+        'question_types': sorted(question_types)
+    }
+
+# Numeric sort key for a session; sessions saved before ts_epoch existed parse the ISO string.
+# The session dict is left untouched (it is user data and feeds the save diff).
+def _session_epoch(session: Dict[str, Any]) -> float:
+    epoch = session.get('ts_epoch')
+    if epoch is None:
+        epoch = datetime.fromisoformat(session['timestamp']).timestamp()
+    return epoch
+
+# Filtered/sorted quiz history as indices into the session list. `_sessions` is not
+# hashed; `sessions_version` stands in for it and must cover every position and every
+# field the filter/sort reads, since the cached indices are only valid for that exact list.
+# Returning indices keeps the cached payload small instead of copying whole session dicts.
+@st.cache_data(show_spinner=False, max_entries=64)
+def _filter_and_sort_cached(_sessions, sessions_version, filter_difficulty, filter_type, sort_by) -> List[int]:
+    filtered = range(len(_sessions))
+    if filter_difficulty != "All":
+        filtered = [i for i in filtered if _sessions[i]['difficulty'] == filter_difficulty]
+    if filter_type != "All":
+        filtered = [i for i in filtered if _sessions[i].get('question_type', 'Mixed Questions') == filter_type]
+
+    reverse = True
+    if sort_by == "Date (Newest)":
+        key = lambda i: _session_epoch(_sessions[i])
+    elif sort_by == "Date (Oldest)":
+        key = lambda i: _session_epoch(_sessions[i])
+        reverse = False
+    elif sort_by == "Score (Highest)":
+        key = lambda i: _sessions[i]['score']
+    else:
+        key = lambda i: _sessions[i]['score']
+        reverse = False
+
+    return sorted(filtered, key=key, reverse=reverse)
+
 class AdvancedQuizSystem:
     def __init__(self, quiz_generator):
         self.quiz_generator = quiz_generator
@@ -55,7 +159,7 @@ class AdvancedQuizSystem:
 
             # Format questions with all required fields
             for i, q in enumerate(normalized.get('questions', [])):
-                formatted_quiz['questions'].append({
+                formatted_q = {
                     'id': i + 1,
                     'question': q.get('question', '').strip(),
                     'type': q.get('type', quiz_type_internal),
@@ -63,7 +167,10 @@ class AdvancedQuizSystem:
                     'correct_answer': str(q.get('correct_answer', '')),
                     'explanation': q.get('explanation', ''),
                     'points': q.get('points', 1)
-                })
+                }
+                if formatted_q['type'] == 'multiple_choice':
+                    self._letter_map(formatted_q)
+                formatted_quiz['questions'].append(formatted_q)
 
             return formatted_quiz
 
@@ -108,8 +215,7 @@ class AdvancedQuizSystem:
 
         # Display current question or results
         if not st.session_state.quiz_state['completed']:
-            self._display_question(quiz_data['questions'][current], current)
-            self._display_navigation(quiz_data, total, current)
+            self._display_question(quiz_data['questions'][current], current, total)
         else:
             self._display_quiz_results(quiz_data)
     # Displays quiz history with retake functionality
@@ -125,28 +231,35 @@ class AdvancedQuizSystem:
         st.header("📚 Quiz History")
 
         # Stats summary
+        summary = _summarize_quiz_sessions(tuple(
+            (s['score'], s['difficulty'], s.get('question_type', 'Mixed Questions')) for s in quiz_sessions
+        ))
         col1, col2, col3 = st.columns(3)
-        col1.metric("Total Quizzes", len(quiz_sessions))
-        avg_score = sum(s['score'] for s in quiz_sessions) / len(quiz_sessions)
-        col2.metric("Average Score", f"{avg_score:.1f}%")
-        best_score = max(s['score'] for s in quiz_sessions)
-        col3.metric("Best Score", f"{best_score:.1f}%")
+        col1.metric("Total Quizzes", summary['total'])
+        col2.metric("Average Score", f"{summary['avg_score']:.1f}%")
+        col3.metric("Best Score", f"{summary['best_score']:.1f}%")
 
         # Filter options
         col1, col2, col3 = st.columns(3)
         with col1:
-            filter_difficulty = st.selectbox("Filter by difficulty:", ["All"] + sorted(list(set(s['difficulty'] for s in quiz_sessions))))
+            filter_difficulty = st.selectbox("Filter by difficulty:", ["All"] + summary['difficulties'])
         with col2:
-            filter_type = st.selectbox("Filter by type:", ["All"] + sorted(list(set(s.get('question_type', 'Mixed Questions') for s in quiz_sessions))))
+            filter_type = st.selectbox("Filter by type:", ["All"] + summary['question_types'])
         with col3:
             sort_by = st.selectbox("Sort by:", ["Date (Newest)", "Date (Oldest)", "Score (Highest)", "Score (Lowest)"])
 
         # Apply filters and sorting
         filtered_sessions = self._filter_and_sort_sessions(quiz_sessions, filter_difficulty, filter_type, sort_by)
 
-        # Display sessions
+        # Display sessions, one page at a time
         st.subheader("Quiz Attempts")
-        for i, session in enumerate(filtered_sessions):
+        page_size = 20
+        page_count = max(1, (len(filtered_sessions) + page_size - 1) // page_size)
+        page = 1
+        if page_count > 1:
+            page = st.number_input("Page", min_value=1, max_value=page_count, value=1, step=1)
+        start = (page - 1) * page_size
+        for i, session in enumerate(filtered_sessions[start:start + page_size], start):
             with st.expander(f"{session['title']} - {session['score']:.1f}% - {session['timestamp'][:10]}"):
                 col1, col2 = st.columns([3,1])
                 with col1:
@@ -177,6 +290,7 @@ class AdvancedQuizSystem:
         total = 0
         correct = 0
         details = []
+        ai_verdicts = self._batch_ai_check_short_answers(quiz, user_answers)
 
         for q in quiz.get('questions', []):
             qid = q.get('id')
@@ -184,7 +298,7 @@ class AdvancedQuizSystem:
                 continue
 
             total += 1
-            result = self._grade_question(q, user_answers.get(qid))
+            result = self._grade_question(q, user_answers.get(qid), ai_verdicts.get(qid))
             if result['is_correct']:
                 correct += 1
             details.append(result)
@@ -210,14 +324,12 @@ class AdvancedQuizSystem:
 
         # Convert to flat results for display
         results = []
-        question_types = {}
+        type_totals = Counter()
+        type_correct = Counter()
         for detail in grading_result['details']:
             q_type = detail['type']
-            if q_type not in question_types:
-                question_types[q_type] = {'correct': 0, 'total': 0}
-            question_types[q_type]['total'] += 1
-            if detail['is_correct']:
-                question_types[q_type]['correct'] += 1
+            type_totals[q_type] += 1
+            type_correct[q_type] += detail['is_correct']
 
             results.append({
                 'question_number': detail.get('question_id', 0),
@@ -238,7 +350,7 @@ class AdvancedQuizSystem:
         col3.metric("Time Taken", f"{time_taken.seconds//60}m {time_taken.seconds%60}s")
 
         # Performance insights
-        self._display_performance_analysis(grading_result['percent'], question_types, results)
+        self._display_performance_analysis(grading_result['percent'], type_totals, type_correct, results)
 
         # Per-question insights dropdowns 
         st.subheader("🔎 Question Insights")
@@ -255,7 +367,7 @@ class AdvancedQuizSystem:
                     st.caption(f"💡 {d['explanation']}")
 
         # Save results
-        self._save_quiz_results(quiz_data, results, grading_result['percent'], time_taken)
+        self._save_quiz_results(quiz_data, results, grading_result, time_taken)
 
         # Navigation
         col1, col2 = st.columns(2)
@@ -278,7 +390,7 @@ class AdvancedQuizSystem:
     # Helper Methods 
     # -----------------------------
     # Displays each question
-    def _display_question(self, question, index):
+    def _display_question(self, question, index, total):
         """Display a single question """
         st.subheader(f"Question {index + 1}")
         st.markdown(f"**Type:** {question['type'].replace('_', ' ').title()}")
@@ -288,65 +400,77 @@ class AdvancedQuizSystem:
         key = f"q_{qid}"
 
         help_text = "Open the insights dropdown on the results page to review your answer vs correct answer."
+        quiz_state = st.session_state.quiz_state
+        answers = quiz_state['answers']
+
+        # Widgets inside a form don't rerun the script on every click/keystroke;
+        # the navigation buttons submit the form, so the answer is stored with them
+        with st.form(key=f"qform_{qid}"):
+            if question['type'] == 'multiple_choice':
+                options = question.get('options', [])
+                selected = st.radio("Select answer:", options, key=key, index=None, help=help_text)
+            elif question['type'] == 'true_false':
+                selected = st.radio("Select answer:", ["True", "False"], key=key, index=None, help=help_text)
+            elif question['type'] in ['short_answer', 'fill_blank']:
+                default_val = answers[qid] if isinstance(answers.get(qid), str) else ""
+                selected = st.text_input("Your answer:", value=default_val, key=key, help=help_text, placeholder="Type your answer here")
+            else:
+                # Fallback to short answer if an unknown type slips through
+                selected = st.text_input("Your answer:", key=key, help=help_text, placeholder="Type your answer here")
+            action = self._display_navigation(total, index)
+
+        if action:
+            if question['type'] == 'multiple_choice':
+                if selected is not None and selected != "":
+                    answers[qid] = {
+                        'answer': selected,
+                        'letter': self._extract_answer_letter(selected)
+                    }
+            elif question['type'] == 'true_false':
+                if selected is not None and selected != "":
+                    answers[qid] = selected
+            elif selected is not None:
+                answers[qid] = selected
+
+            if action == 'previous':
+                quiz_state['current_question'] -= 1
+                st.rerun()
+            elif action in ('next', 'finish'):
+                # require current question answered before moving on
+                if qid in answers:
+                    if action == 'next':
+                        quiz_state['current_question'] += 1
+                    else:
+                        quiz_state['completed'] = True
+                    st.rerun()
+                else:
+                    st.warning("Please answer the question first")
 
-        if question['type'] == 'multiple_choice':
-            options = question.get('options', [])
-            selected = st.radio("Select answer:", options, key=key, index=None, help=help_text)
-            if selected is not None and selected != "":
-                st.session_state.quiz_state['answers'][qid] = {
-                    'answer': selected,
-                    'letter': self._extract_answer_letter(selected)
-                }
-
-        elif question['type'] == 'true_false':
-            selected = st.radio("Select answer:", ["True", "False"], key=key, index=None, help=help_text)
-            if selected is not None and selected != "":
-                st.session_state.quiz_state['answers'][qid] = selected
-
-        elif question['type'] in ['short_answer', 'fill_blank']:
-            default_val = ""
-            if qid in st.session_state.quiz_state['answers'] and isinstance(st.session_state.quiz_state['answers'][qid], str):
-                default_val = st.session_state.quiz_state['answers'][qid]
-            answer = st.text_input("Your answer:", value=default_val, key=key, help=help_text, placeholder="Type your answer here")
-            if answer is not None:
-                st.session_state.quiz_state['answers'][qid] = answer
-        else:
-            # Fallback to short answer if an unknown type slips through
-            answer = st.text_input("Your answer:", key=key, help=help_text, placeholder="Type your answer here")
-            if answer is not None:
-                st.session_state.quiz_state['answers'][qid] = answer
-
-        if qid in st.session_state.quiz_state['answers']:
+        if qid in answers:
             st.info("🔵 Answered")
-    #Navigation buttons, eg previous next etc.
-    def _display_navigation(self, quiz_data, total, current):
+    #Navigation buttons, eg previous next etc. Rendered inside the question form
+    def _display_navigation(self, total, current):
+        """Return which submit button was clicked: 'previous', 'save', 'next', 'finish' or None"""
         col1, col2, col3 = st.columns([1,1,1])
+        action = None
 
         with col1:
-            if current > 0 and st.button("← Previous"):
-                st.session_state.quiz_state['current_question'] -= 1
-                st.rerun()
+            if current > 0 and st.form_submit_button("← Previous"):
+                action = 'previous'
 
         with col2:
-            if current < total - 1 and st.button("Next →"):
-                # require current question answered before moving on
-                current_qid = quiz_data['questions'][current]['id']
-                if current_qid in st.session_state.quiz_state['answers']:
-                    st.session_state.quiz_state['current_question'] += 1
-                    st.rerun()
-                else:
-                    st.warning("Please answer the question first")
+            if st.form_submit_button("💾 Save Answer"):
+                action = 'save'
 
         with col3:
-            if current == total - 1 and st.button("🏁 Finish Quiz"):
-                current_qid = quiz_data['questions'][current]['id']
-                if current_qid in st.session_state.quiz_state['answers']:
-                    st.session_state.quiz_state['completed'] = True
-                    st.rerun()
-                else:
-                    st.warning("Please answer the question first")
+            if current < total - 1:
+                if st.form_submit_button("Next →"):
+                    action = 'next'
+            elif st.form_submit_button("🏁 Finish Quiz"):
+                action = 'finish'
+        return action
     # Displays how good you did
-    def _display_performance_analysis(self, score, question_types, results):
+    def _display_performance_analysis(self, score, type_totals, type_correct, results):
         """Display detailed performance analysis (app.py compatible)"""
         if score >= 90:
             st.success("🌟 Outstanding performance! You've mastered this material.")
@@ -359,9 +483,9 @@ class AdvancedQuizSystem:
 
         # Performance by question type
         st.subheader("By Question Type")
-        for q_type, stats in question_types.items():
+        for q_type, total in type_totals.items():
             type_name = q_type.replace('_', ' ').title()
-            accuracy = (stats['correct'] / stats['total']) * 100 if stats['total'] else 0
+            accuracy = (type_correct[q_type] / total) * 100 if total else 0
 
             if accuracy >= 80:
                 st.success(f"• {type_name}: {accuracy:.1f}% accuracy")
@@ -371,11 +495,11 @@ class AdvancedQuizSystem:
                 st.error(f"• {type_name}: {accuracy:.1f}% accuracy")
 
         # Specific recommendations
-        incorrect = [r for r in results if not r['is_correct']]
+        incorrect = list(itertools.islice((r for r in results if not r['is_correct']), 5))
         if incorrect:
             st.subheader("🔍 Focus Areas")
             st.write("You missed these concepts:")
-            for i, r in enumerate(incorrect[:5]):
+            for r in incorrect:
                 st.write(f"- {r['question'][:100]}...")
 
         # Study recommendations
@@ -391,14 +515,16 @@ class AdvancedQuizSystem:
             st.write("- Practice with similar quizzes")
             st.write("- Study in shorter, more frequent sessions")
     # Saves the quiz results ot the database or session state
-    def _save_quiz_results(self, quiz_data, results, score, time_taken):
+    def _save_quiz_results(self, quiz_data, results, grading_result, time_taken):
         """Save quiz results to session state (app.py compatible)"""
+        now = datetime.now()
         quiz_result = {
-            'timestamp': datetime.now().isoformat(),
+            'timestamp': now.isoformat(),
+            'ts_epoch': now.timestamp(),
             'title': quiz_data['title'],
-            'score': score,
-            'correct_answers': sum(1 for r in results if r['is_correct']),
-            'total_questions': len(results),
+            'score': grading_result['percent'],
+            'correct_answers': grading_result['score'],
+            'total_questions': grading_result['total'],
             'difficulty': quiz_data['metadata']['difficulty'],
             'question_type': quiz_data['metadata'].get('question_type', 'Mixed Questions'),
             'activity_type': 'quiz',
@@ -420,8 +546,7 @@ class AdvancedQuizSystem:
     # Filters and sorts quiz sessions based on user selection
     def _extract_answer_letter(self, answer):
         """Extract letter from multiple choice answer (app.py compatible)"""
-        match = re.match(r'^([A-Za-z])[\)\.]?\s*', str(answer).strip())
-        return match.group(1).upper() if match else ""
+        return _extract_answer_letter(str(answer))
     # cleans ai generated stuff
     def _normalize_questions(self, quiz_data: Dict[str, Any], fallback_type: str) -> Dict[str, Any]:
         """Enhanced question normalization from new version"""
@@ -432,7 +557,7 @@ class AdvancedQuizSystem:
             raw = json.dumps(quiz_data) if not isinstance(quiz_data, str) else quiz_data
             cleaned = self._clean_model_json(raw)
             try:
-                candidate = json.loads(cleaned)
+                candidate = _json_loads(cleaned)
                 questions = candidate.get("questions", [])
                 data.update(candidate)
             except Exception:
@@ -450,87 +575,89 @@ class AdvancedQuizSystem:
             q = self._ensure_question_fields(q, fallback_type)
             normalized_questions.append(q)
 
-        # Deduplicate questions by text
-        seen = set()
-        unique_questions = []
+        # Deduplicate questions by text (first occurrence wins, order preserved)
+        unique_questions = {}
         for q in normalized_questions:
-            if q["question"] not in seen:
-                unique_questions.append(q)
-                seen.add(q["question"])
+            unique_questions.setdefault(q["question"], q)
 
-        data["questions"] = unique_questions
+        data["questions"] = list(unique_questions.values())
         return data
 
     # Ensure all feilds exist
     def _ensure_question_fields(self, q: Dict[str, Any], fallback_type: str) -> Dict[str, Any]:
         """Ensure all required question fields exist with proper values"""
+        opts = q.get("options")
+        correct = q.get("correct_answer")
+        explanation = q.get("explanation", "")
+
         # Determine question type
         qtype = (q.get("type") or fallback_type or "").lower()
-        if qtype not in ("multiple_choice", "true_false", "short_answer", "mixed"):
+        if qtype not in _QUESTION_TYPES:
             # Anything unknown becomes short answer so a text box appears
             qtype = "short_answer"
         if qtype == "mixed":
-            if isinstance(q.get("options"), list) and q.get("options"):
+            if opts and isinstance(opts, list):
                 qtype = "multiple_choice"
-            elif isinstance(q.get("correct_answer"), str) and q.get("correct_answer").strip().lower() in ("true", "false"):
+            elif isinstance(correct, str) and correct.strip().lower() in ("true", "false"):
                 qtype = "true_false"
             else:
                 qtype = "short_answer"
         q["type"] = qtype
 
         # Ensure correct answer exists
-        if "correct_answer" not in q or not q.get("correct_answer"):
+        if not correct:
             for alt in ("sample_answer", "expected_answer", "answer", "key_points"):
-                if q.get(alt):
-                    q["correct_answer"] = q[alt]
+                alt_value = q.get(alt)
+                if alt_value:
+                    correct = alt_value
                     break
-            if not q.get("correct_answer") and qtype == "true_false":
-                inferred = self._infer_true_false_from_text(q.get("explanation", "")) or ""
-                q["correct_answer"] = inferred
+            if not correct and qtype == "true_false":
+                correct = self._infer_true_false_from_text(explanation) or ""
 
         # Clean fields
-        q["question"] = (q.get("question") or "").strip()
-        q["explanation"] = q.get("explanation", "")
-        q["correct_answer"] = str(q.get("correct_answer", ""))
+        question = (q.get("question") or "").strip()
+        q["question"] = question
+        q["explanation"] = explanation
+        correct = "" if correct is None else str(correct)
 
         # Handle question type specifics
         if qtype == "true_false":
-            ans = q["correct_answer"].strip().lower()
-            if ans in ["a) true", "true", "t", "yes", "1"]:
-                q["correct_answer"] = "True"
-            elif ans in ["b) false", "false", "f", "no", "0"]:
-                q["correct_answer"] = "False"
-
-        if qtype == "multiple_choice":
-            opts = q.get("options", [])
-            if not isinstance(opts, list) or not opts:
-                opts = self._extract_options_from_text(q.get("question", ""))
+            ans = correct.strip().lower()
+            if ans in _TRUE_SET:
+                correct = "True"
+            elif ans in _FALSE_SET:
+                correct = "False"
+        elif qtype == "multiple_choice":
+            if not opts or not isinstance(opts, list):
+                opts = self._extract_options_from_text(question)
             q["options"] = opts
-            q["correct_answer"] = self._normalize_mc_correct(q["correct_answer"], opts)
+            correct = self._normalize_mc_correct(correct, opts)
 
+        q["correct_answer"] = correct
         return q
     # Grades questions
-    def _grade_question(self, question: Dict[str, Any], user_answer: Any) -> Dict[str, Any]:
-        """Grade a single question with improved robustness"""
+    def _grade_question(self, question: Dict[str, Any], user_answer: Any, ai_verdict: Optional[bool] = None) -> Dict[str, Any]:
+        """Grade a single question with improved robustness (ai_verdict: pre-computed AI short answer result)"""
         qtype = (question.get("type") or "").lower()
         correct_answer = str(question.get("correct_answer", "")).strip()
         explanation = question.get("explanation", "")
         
         is_correct = False
-        normalized_user = self._coerce_answer_for_type(user_answer, qtype)
-        normalized_correct = self._coerce_answer_for_type(correct_answer, qtype)
-
         if qtype == "multiple_choice":
-            is_correct = self._compare_mc_answer(normalized_user, normalized_correct, question)
-        elif qtype == "true_false":
-            is_correct = str(normalized_user).lower() == str(normalized_correct).lower()
-        else:  # short_answer or unknown
-            if isinstance(normalized_user, str) and isinstance(normalized_correct, str):
-                u = normalized_user.strip().lower()
-                c = normalized_correct.strip().lower()
+            # _compare_mc_answer does its own str/strip normalization, so skip the coercion
+            is_correct = self._compare_mc_answer(user_answer, correct_answer, question)
+        else:
+            normalized_user = self._coerce_answer_for_type(user_answer, qtype)
+            normalized_correct = self._coerce_answer_for_type(correct_answer, qtype)
+
+            if qtype == "true_false":
+                is_correct = str(normalized_user).lower() == str(normalized_correct).lower()
+            elif isinstance(normalized_user, str) and isinstance(normalized_correct, str):  # short_answer or unknown
                 # First, quick fuzzy check
-                if (u == c) or (c in u) or (u in c):
+                if self._fuzzy_short_answer_match(normalized_user, normalized_correct):
                     is_correct = True
+                elif ai_verdict is not None:
+                    is_correct = ai_verdict
                 else:
                     # Use AI to judge correctness more flexibly (best-effort)
                     is_correct = self._ai_check_short_answer(
@@ -558,21 +685,20 @@ class AdvancedQuizSystem:
         """Clean common LLM JSON issues (robust to code fences)"""
         if not isinstance(text, str):
             try:
-                text = json.dumps(text)
+                text = _json_dumps(text)
             except Exception:
                 text = str(text)
 
         s = text.strip()
         # Remove json / fences at start and end
-        s = re.sub(r"^```(?:json)?\s*", "", s, flags=re.IGNORECASE)
-        s = re.sub(r"```\s*$", "", s, flags=re.IGNORECASE)
+        s = _RE_FENCE_START.sub("", s)
+        s = _RE_FENCE_END.sub("", s)
         # Normalize quotes and control 
-        s = s.replace("“", '"').replace("”", '"').replace("‘", "'").replace("’", "'")
-        s = re.sub(r"[\x00-\x08\x0B\x0C\x0E-\x1F]", " ", s)
+        s = s.translate(_CLEAN_TRANSLATE_TBL)
         # Fix stray backslashes
-        s = re.sub(r'\\(?!["\\/bfnrtu])', r'\\\\', s)
+        s = _RE_BSLASH.sub(r'\\\\', s)
         # Remove trailing commas
-        s = re.sub(r",\s*([}\]])", r"\1", s)
+        s = _RE_TRAIL_COMMA.sub(r"\1", s)
         return s
 
     def _try_parse_question_dict(self, qtext: str) -> Optional[Dict[str, Any]]:
@@ -581,7 +707,7 @@ class AdvancedQuizSystem:
             return None
         cleaned = self._clean_model_json(qtext)
         try:
-            obj = json.loads(cleaned)
+            obj = _json_loads(cleaned)
             return obj if isinstance(obj, dict) else None
         except Exception:
             return None
@@ -589,14 +715,14 @@ class AdvancedQuizSystem:
     def _infer_true_false_from_text(self, text: str) -> Optional[str]:
         if not text or not isinstance(text, str):
             return None
-        m = re.search(r"\b(true|false)\b", text, flags=re.IGNORECASE)
+        m = _RE_TF.search(text)
         return m.group(1).capitalize() if m else None
     # Extracts multiple choice options form the text
     def _extract_options_from_text(self, text: str) -> List[str]:
         """Extract MC options from text"""
         if not text:
             return []
-        matches = re.findall(r"(?:^|\s)[A-D]\)\s*([^;|\n]+)", text)
+        matches = _RE_MC_OPTS.findall(text)
         return [m.strip() for m in matches] if matches else []
 
     def _normalize_mc_correct(self, correct: Any, options: List[str]) -> str:
@@ -606,16 +732,16 @@ class AdvancedQuizSystem:
         c = str(correct).strip()
 
         # If a single letter was provided
-        if re.fullmatch(r"[A-Z]", c, flags=re.IGNORECASE):
+        if _RE_LETTER.fullmatch(c):
             return c.upper()
 
         # If exact option text was provided
-        for idx, opt in enumerate(options):
-            if c.lower() == str(opt).strip().lower():
+        lo = c.lower()
+        for opt in options:
+            if lo == str(opt).strip().lower():
                 return opt
 
-        
-        m = re.match(r"([A-Da-d])\b", c)
+        m = _RE_MC_LEAD.match(c)
         if m:
             return m.group(1).upper()
 
@@ -628,9 +754,9 @@ class AdvancedQuizSystem:
                 return "True" if ans else "False"
             if isinstance(ans, str):
                 s = ans.strip().lower()
-                if s in ("true", "t", "yes", "y", "1"):
+                if s in _TRUE_SET:
                     return "True"
-                if s in ("false", "f", "no", "n", "0"):
+                if s in _FALSE_SET:
                     return "False"
         if isinstance(ans, str):
             return ans.strip()
@@ -638,13 +764,6 @@ class AdvancedQuizSystem:
 
     def _compare_mc_answer(self, user_ans: Any, correct_ans: Any, q: Dict[str, Any]) -> bool:
         """Robust MC answer comparison"""
-        options = [str(o).strip() for o in q.get("options", [])]
-        if not options:
-            return str(user_ans).strip().lower() == str(correct_ans).strip().lower()
-
-        letters = [chr(ord('A') + i) for i in range(len(options))]
-        letter_to_text = dict(zip(letters, options))
-
         # Pull stored values
         if isinstance(user_ans, dict) and 'answer' in user_ans:
             u = str(user_ans['answer']).strip()
@@ -652,58 +771,104 @@ class AdvancedQuizSystem:
             u = str(user_ans).strip()
         c = str(correct_ans).strip()
 
+        # Same letter or same text is correct however the options are laid out
+        if c and u.lower() == c.lower():
+            return True
+
+        letter_to_text = self._letter_map(q)
+        if not letter_to_text:
+            return u.lower() == c.lower()
+
         # If correct is a letter (A/B/C/D)
         if c.upper() in letter_to_text:
             if u.upper() == c.upper():
                 return True
-            return u.lower() == letter_to_text[c.upper()].lower()
+            return u.lower() == letter_to_text[c.upper()]
 
         # If correct is exact text
         if c:
-            if u.lower() == c.lower():
-                return True
             # If user picked a letter that corresponds to the correct text
+            cl = c.lower()
             for L, txt in letter_to_text.items():
-                if txt.lower() == c.lower():
+                if txt == cl:
                     return u.upper() == L
         return False
 
+    def _letter_map(self, q: Dict[str, Any]) -> Dict[str, str]:
+        """Letter -> lowercased option text, built once and kept on the question"""
+        letter_map = q.get('_letter_map')
+        if letter_map is None:
+            options = [str(o).strip().lower() for o in q.get("options", [])]
+            letter_map = q['_letter_map'] = dict(zip(_LETTERS, options))
+        return letter_map
+
     def _filter_and_sort_sessions(self, sessions, filter_difficulty, filter_type, sort_by):
-        """Filter and sort quiz sessions"""
-        filtered = sessions
-        if filter_difficulty != "All":
-            filtered = [s for s in filtered if s['difficulty'] == filter_difficulty]
-        if filter_type != "All":
-            filtered = [s for s in filtered if s.get('question_type', 'Mixed Questions') == filter_type]
-
-        reverse = True
-        if sort_by == "Date (Newest)":
-            key = lambda x: x['timestamp']
-        elif sort_by == "Date (Oldest)":
-            key = lambda x: x['timestamp']
-            reverse = False
-        elif sort_by == "Score (Highest)":
-            key = lambda x: x['score']
-        else:  
-            key = lambda x: x['score']
-            reverse = False
-
-        return sorted(filtered, key=key, reverse=reverse)
+        """Filter and sort quiz sessions (cached across reruns while the history is unchanged)"""
+        if not sessions:
+            return []
+        # Per-position snapshot: a reload can return the same sessions in a different order
+        version = tuple(
+            (sess['timestamp'], sess['score'], sess['difficulty'], sess.get('question_type', 'Mixed Questions'))
+            for sess in sessions
+        )
+        order = _filter_and_sort_cached(sessions, version, filter_difficulty, filter_type, sort_by)
+        return [sessions[i] for i in order]
 
     # -----------------------------
     # AI-assisted short answer grading
     # -----------------------------
 
+    def _fuzzy_short_answer_match(self, user_answer: str, correct_answer: str) -> bool:
+        u = user_answer.strip().lower()
+        c = correct_answer.strip().lower()
+        if (u == c) or (c in u) or (u in c):
+            return True
+        # Answers that differ only by filler words count as correct without an AI call;
+        # any other difference (antonyms, numbers, units, negations) goes to the AI grader
+        u_tokens = frozenset(_RE_WORD.findall(u))
+        c_tokens = frozenset(_RE_WORD.findall(c))
+        if not u_tokens or not c_tokens:
+            return False
+        return (u_tokens ^ c_tokens) <= _SHORT_ANSWER_STOPWORDS
+
+    def _short_answer_prompt(self, question_text: str, correct_answer: str, user_answer: Union[str, Any]) -> str:
+        return (
+            "You are grading a short answer question.\n"
+            f"Question: {question_text}\n"
+            f"Correct Answer: {correct_answer}\n"
+            f"Student's Answer: {user_answer}\n"
+            "Respond only with 'true' if the student's answer is correct, or 'false' if it is incorrect."
+        )
+
+    def _batch_ai_check_short_answers(self, quiz: Dict[str, Any], user_answers: Dict[int, Any]) -> Dict[int, bool]:
+        """Grade every short answer that fails the fuzzy check in a single AI request"""
+        if not callable(getattr(self.quiz_generator, 'grade_short_answers', None)):
+            return {}
+        pending = []
+        for q in quiz.get('questions', []):
+            qid = q.get('id')
+            qtype = (q.get("type") or "").lower()
+            if qid is None or qtype in ("multiple_choice", "true_false"):
+                continue
+            user_answer = user_answers.get(qid)
+            correct_answer = str(q.get("correct_answer", "")).strip()
+            user = self._coerce_answer_for_type(user_answer, qtype)
+            correct = self._coerce_answer_for_type(correct_answer, qtype)
+            if isinstance(user, str) and isinstance(correct, str) and not self._fuzzy_short_answer_match(user, correct):
+                pending.append((qid, self._short_answer_prompt(q.get("question", ""), correct_answer, user_answer)))
+        if not pending:
+            return {}
+        try:
+            results = self.quiz_generator.grade_short_answers([prompt for _, prompt in pending])
+        except Exception as e:
+            st.warning(f"AI short answer check failed: {e}")
+            return {}
+        return {qid: str(r).strip().lower().startswith('t') for (qid, _), r in zip(pending, results)}
+
     def _ai_check_short_answer(self, question_text: str, correct_answer: str, user_answer: Union[str, Any]) -> bool:
         try:
             if hasattr(self.quiz_generator, 'grade_short_answer') and callable(getattr(self.quiz_generator, 'grade_short_answer')):
-                prompt = (
-                    "You are grading a short answer question.\n"
-                    f"Question: {question_text}\n"
-                    f"Correct Answer: {correct_answer}\n"
-                    f"Student's Answer: {user_answer}\n"
-                    "Respond only with 'true' if the student's answer is correct, or 'false' if it is incorrect."
-                )
+                prompt = self._short_answer_prompt(question_text, correct_answer, user_answer)
                 result = self.quiz_generator.grade_short_answer(prompt)
                 return str(result).strip().lower().startswith('t')
             else:
@@ -8,7 +8,6 @@ import io
 import re
 import random                       # For choosing random numbers
 import calendar                     # For building the calendar view
-import hashlib                      # For hashing passwords
 from datetime import datetime       # For dates
 from datetime import timedelta      # For duration 
 from collections import defaultdict
@@ -57,10 +56,10 @@ supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
 
 # Functions
 
-# Hash a raw password into SHA-256
+# Hash a raw password with the same salted scrypt scheme as user_data
 def hash_password(password: str) -> str:
-    # Returns a hex string hash for secure storage
-    return hashlib.sha256(password.encode()).hexdigest()
+    # Returns a "salt:hash" hex string for secure storage
+    return user_data.hash_password(password)
 
 # Delete any user's account, admin only.
 def admin_delete_account(target_username: str):
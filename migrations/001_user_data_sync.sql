@@ -0,0 +1,76 @@
+-- Author: Victor
+-- Migration: 001_user_data_sync.sql
+-- Purpose: Schema required by user_data.py (row-level upsert sync, one-call delete/export)
+-- Run once in the Supabase SQL editor BEFORE deploying the matching app code.
+
+-- 1. Stable client-assigned uuid ids and a (username, id) primary key on every data table.
+--    Supabase's default bigint identity id is converted; existing rows get fresh uuids.
+DO $$
+DECLARE
+    t text;
+    id_type text;
+BEGIN
+    FOREACH t IN ARRAY ARRAY['notes', 'flashcards', 'study_sessions', 'events'] LOOP
+        SELECT data_type INTO id_type
+        FROM information_schema.columns
+        WHERE table_schema = 'public' AND table_name = t AND column_name = 'id';
+
+        EXECUTE format('ALTER TABLE public.%I DROP CONSTRAINT IF EXISTS %I', t, t || '_pkey');
+
+        IF id_type IS NULL THEN
+            EXECUTE format('ALTER TABLE public.%I ADD COLUMN id uuid NOT NULL DEFAULT gen_random_uuid()', t);
+        ELSIF id_type <> 'uuid' THEN
+            EXECUTE format('ALTER TABLE public.%I ALTER COLUMN id DROP IDENTITY IF EXISTS', t);
+            EXECUTE format('ALTER TABLE public.%I ALTER COLUMN id DROP DEFAULT', t);
+            EXECUTE format('ALTER TABLE public.%I ALTER COLUMN id TYPE uuid USING gen_random_uuid()', t);
+            EXECUTE format('ALTER TABLE public.%I ALTER COLUMN id SET DEFAULT gen_random_uuid()', t);
+        END IF;
+
+        EXECUTE format('ALTER TABLE public.%I ADD PRIMARY KEY (username, id)', t);
+    END LOOP;
+END $$;
+
+-- 2. Per-user listing indexes (the primary key already covers username lookups and id deletes)
+CREATE INDEX IF NOT EXISTS notes_username_created_idx ON public.notes (username, created_at);
+CREATE INDEX IF NOT EXISTS flashcards_username_created_idx ON public.flashcards (username, created_at);
+CREATE INDEX IF NOT EXISTS study_sessions_username_timestamp_idx ON public.study_sessions (username, timestamp);
+CREATE INDEX IF NOT EXISTS events_username_created_idx ON public.events (username, created_at);
+
+-- 3. Wipe a user's data in one transaction (user_data._delete_user_data)
+CREATE OR REPLACE FUNCTION public.delete_user_data(u text) RETURNS void
+LANGUAGE plpgsql AS $$
+BEGIN
+    DELETE FROM public.notes WHERE username = u;
+    DELETE FROM public.flashcards WHERE username = u;
+    DELETE FROM public.study_sessions WHERE username = u;
+    DELETE FROM public.events WHERE username = u;
+END;
+$$;
+
+-- 4. Whole-account export in one round trip (user_data.export_user_data).
+--    user_info deliberately leaves out the password hash.
+CREATE OR REPLACE FUNCTION public.export_all(u text) RETURNS jsonb
+LANGUAGE sql STABLE AS $$
+    SELECT jsonb_build_object(
+        'notes', (SELECT jsonb_agg(n) FROM public.notes n WHERE n.username = u),
+        'flashcards', (SELECT jsonb_agg(f) FROM public.flashcards f WHERE f.username = u),
+        'study_sessions', (SELECT jsonb_agg(s) FROM public.study_sessions s WHERE s.username = u),
+        'events', (SELECT jsonb_agg(e) FROM public.events e WHERE e.username = u),
+        'user_info', (SELECT jsonb_build_object('username', x.username, 'created_at', x.created_at)
+                      FROM public.users x WHERE x.username = u)
+    );
+$$;
+
+-- 5. One row per username; register_user relies on this (unique_violation 23505) to reject
+--    duplicates. Fails loudly if duplicate usernames already exist - resolve those first.
+DO $$
+BEGIN
+    IF NOT EXISTS (
+        SELECT 1 FROM pg_constraint
+        WHERE conrelid = 'public.users'::regclass AND contype IN ('u', 'p')
+          AND conkey = ARRAY[(SELECT attnum FROM pg_attribute
+                              WHERE attrelid = 'public.users'::regclass AND attname = 'username')]
+    ) THEN
+        ALTER TABLE public.users ADD CONSTRAINT users_username_key UNIQUE (username);
+    END IF;
+END $$;
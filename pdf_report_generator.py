@@ -6,13 +6,19 @@ from reportlab.lib.units import inch
 from reportlab.lib import colors
 from reportlab.lib.enums import TA_CENTER, TA_LEFT, TA_RIGHT
 from datetime import datetime, timedelta
+from collections import defaultdict, OrderedDict
+from operator import itemgetter
+from xml.sax.saxutils import escape
 import io
 import base64
 
 class PDFReportGenerator:
+    _SESSION_CACHE_SIZE = 32
+
     def __init__(self):
         self.styles = getSampleStyleSheet()
         self._setup_custom_styles()
+        self._session_cache = OrderedDict()
     
     def _setup_custom_styles(self):
         self.title_style = ParagraphStyle(
@@ -50,6 +56,11 @@ class PDFReportGenerator:
             alignment=TA_LEFT,
             fontName='Helvetica'
         )
+        self.card_style = ParagraphStyle(
+            'CardBody',
+            parent=self.body_style,
+            spaceAfter=20
+        )
         self.highlight_style = ParagraphStyle(
             'Highlight',
             parent=self.styles['Normal'],
@@ -70,7 +81,8 @@ class PDFReportGenerator:
         story.append(Spacer(1, 20))
         report_date = datetime.now().strftime("%B %d, %Y")
         story.append(Paragraph(f"Generated on: {report_date}", self.body_style))
-        story.append(Paragraph(f"Study Period: {self._get_study_period(sessions)}", self.body_style))
+        study_period, habits_data = self._get_session_summary(sessions)
+        story.append(Paragraph(f"Study Period: {study_period}", self.body_style))
         story.append(Spacer(1, 30))
         story.append(Paragraph("📋 Executive Summary", self.header_style))
         summary_data = self._create_summary_table(progress_stats)
@@ -125,7 +137,6 @@ class PDFReportGenerator:
             story.append(Paragraph(f"{i}. {rec}", self.body_style))
         story.append(Spacer(1, 20))
         story.append(Paragraph("📅 Study Habits Analysis", self.header_style))
-        habits_data = self._analyze_study_habits(sessions)
         for habit, description in habits_data.items():
             story.append(Paragraph(f"<b>{habit}:</b> {description}", self.body_style))
         story.append(Spacer(1, 20))
@@ -161,6 +172,20 @@ class PDFReportGenerator:
         buffer.close()
         return pdf_data
     
+    def _get_session_summary(self, sessions):
+        """Return (study period, study habits) for sessions, reusing results for unchanged data."""
+        # Sessions carry no id, so key on the count and the timestamps at both ends
+        key = (len(sessions), sessions[0].get("timestamp"), sessions[-1].get("timestamp")) if sessions else (0, None, None)
+        cached = self._session_cache.get(key)
+        if cached is not None:
+            self._session_cache.move_to_end(key)
+            return cached
+        result = (self._get_study_period(sessions), self._analyze_study_habits(sessions))
+        self._session_cache[key] = result
+        if len(self._session_cache) > self._SESSION_CACHE_SIZE:
+            self._session_cache.popitem(last=False)
+        return result
+
     def _get_study_period(self, sessions):
         if not sessions:
             return "No sessions recorded"
@@ -271,19 +296,19 @@ class PDFReportGenerator:
         story.append(Paragraph(f"Cards Mastered: {study_stats.get('mastered', 0)}", self.body_style))
         story.append(Spacer(1, 20))
         story.append(Paragraph("📋 Your Flashcards", self.header_style))
-        categories = {}
+        categories = defaultdict(list)
         for card in flashcards:
-            category = card.get("category", "General")
-            if category not in categories:
-                categories[category] = []
-            categories[category].append(card)
-        for category, cards in categories.items():
+            categories[card.get("category") or "General"].append(card)
+        for category, cards in sorted(categories.items(), key=itemgetter(0)):
             story.append(Paragraph(f"📁 {category}", self.subheader_style))
+            # One paragraph per card; card_style carries the spacing the old Spacer added
             for i, card in enumerate(cards, 1):
-                story.append(Paragraph(f"<b>Card {i}:</b>", self.body_style))
-                story.append(Paragraph(f"<b>Front:</b> {card.get('front', '')}", self.body_style))
-                story.append(Paragraph(f"<b>Back:</b> {card.get('back', '')}", self.body_style))
-                story.append(Spacer(1, 10))
+                story.append(Paragraph(
+                    f"<b>Card {i}:</b><br/>"
+                    f"<b>Front:</b> {escape(str(card.get('front', '')))}<br/>"
+                    f"<b>Back:</b> {escape(str(card.get('back', '')))}",
+                    self.card_style
+                ))
         doc.build(story)
         pdf_data = buffer.getvalue()
         buffer.close()
@@ -3,17 +3,36 @@
 # Page purpose: Progress Tracker for app.py
 # Date of creation: 2025-10-10
 # this file is responsible for tracking user progress, generating statistics, and creating visualizations of study habits and performance, it makes personalized "tips"from looking at your data.
-import json
 from datetime import datetime, timedelta
 import pandas as pd
+import matplotlib
+matplotlib.use("Agg")  # headless server; skip interactive backend probing
+matplotlib.rcParams["font.family"] = "DejaVu Sans"
 import matplotlib.pyplot as plt
+from matplotlib.figure import Figure
 import io
 import base64
+import threading
 
 class ProgressTracker:
     def __init__(self):
         """Initialize progress tracker."""
-        pass
+        self._fig = None
+        self._ax = None
+        # app.py shares one tracker across sessions, so chart drawing is serialized
+        self._chart_lock = threading.Lock()
+
+    def _get_axes(self):
+        """Return the pooled chart axes, cleared and ready for a new chart. Call with _chart_lock held."""
+        if self._fig is None:
+            # A bare Figure stays out of pyplot's global figure registry
+            self._fig = Figure(figsize=(10, 6))
+            self._ax = self._fig.subplots()
+        self._ax.clear()
+        # clear() keeps axes-level state a pie chart changes (frame off, equal aspect)
+        self._ax.set_frame_on(True)
+        self._ax.set_aspect('auto')
+        return self._ax
     
     def add_study_session(self, session_data):
         """Add a study session to progress tracking."""
@@ -48,6 +67,8 @@ class ProgressTracker:
             }
         
         quiz_sessions = [s for s in filtered_sessions if s.get("activity_type") == "quiz" and s.get("score") is not None]
+        # Only the quiz subset needs timestamp order (for the trend)
+        quiz_sessions.sort(key=lambda x: x.get("timestamp", ""))
         
         total_study_time = sum(s.get("duration_minutes", 0) for s in filtered_sessions)
         total_questions = sum(s.get("questions_answered", 0) for s in filtered_sessions)
@@ -75,15 +96,15 @@ class ProgressTracker:
         }
     
     def _calculate_improvement_trend(self, quiz_sessions):
-        """Calculate if performance is improving, declining, or stable."""
+        """Calculate if performance is improving, declining, or stable.
+
+        quiz_sessions must already be in timestamp order.
+        """
         if len(quiz_sessions) < 2:
             return "Insufficient data"
         
-        # Sort by timestamp
-        sorted_sessions = sorted(quiz_sessions, key=lambda x: x.get("timestamp", ""))
-        
         # Take recent sessions for trend analysis
-        recent_sessions = sorted_sessions[-5:] if len(sorted_sessions) >= 5 else sorted_sessions
+        recent_sessions = quiz_sessions[-5:]
         
         if len(recent_sessions) < 2:
             return "Insufficient data"
@@ -125,9 +146,14 @@ class ProgressTracker:
         }
     # Creates progress chart
     def create_progress_chart(self, sessions, chart_type="score_over_time"):
+        with self._chart_lock:
+            return self._draw_progress_chart(sessions, chart_type)
+
+    def _draw_progress_chart(self, sessions, chart_type):
         try:
             plt.style.use('default')
-            fig, ax = plt.subplots(figsize=(10, 6))
+            ax = self._get_axes()
+            fig = self._fig
             
             if chart_type == "score_over_time":
                 quiz_sessions = [s for s in sessions if s.get("activity_type") == "quiz" and s.get("score") is not None]
@@ -184,13 +210,14 @@ class ProgressTracker:
                         ax.text(bar.get_x() + bar.get_width()/2., height,
                                f'{int(height)}', ha='center', va='bottom')
             
-            plt.tight_layout()
+            fig.tight_layout()
             
             img_buffer = io.BytesIO()
-            plt.savefig(img_buffer, format='png', dpi=300, bbox_inches='tight')
+            # tight_layout above already fits the axes, so skip the extra draw pass
+            # bbox_inches='tight' would do; fast zlib level keeps encoding cheap
+            fig.savefig(img_buffer, format='png', dpi=300, pil_kwargs={"compress_level": 1})
             img_buffer.seek(0)
             img_base64 = base64.b64encode(img_buffer.getvalue()).decode()
-            plt.close()
             
             return img_base64
             
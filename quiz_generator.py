@@ -2,13 +2,94 @@
 # Page name: quiz_generator.py
 # Page purpose: Quiz generation system for advanced_quiz_system.py
 # Date of creation: 2025-10-10
+import hashlib
+import io
 import json
 import os
 import re
 import random
-from typing import Dict, Any, List, Optional
+from collections import Counter
+from concurrent.futures import ThreadPoolExecutor
+from typing import Dict, Any, List, Optional, Tuple
+import httpx
+import openai
 from openai import OpenAI
+from tenacity import retry, stop_after_attempt, wait_exponential_jitter, retry_if_exception_type
 import streamlit as st
+
+try:
+    import orjson
+    _json_loads = orjson.loads  # accepts str or bytes, several times faster than json
+except ImportError:
+    _json_loads = json.loads
+
+# Shared pool for concurrent API calls (the OpenAI client is thread-safe)
+_API_POOL = ThreadPoolExecutor(max_workers=4, thread_name_prefix="quiz-api")
+
+# Precompiled patterns used while cleaning content and parsing model output
+_WS_RE = re.compile(r'\s+')
+_FENCE_RE = re.compile(r'^```(?:json)?\s*|\s*```$', re.IGNORECASE)
+_JSON_EXTRACT_RE = re.compile(r'(\{.*\}|\[.*\])', re.DOTALL)
+_QKEY_RE = re.compile(r'Q\d+', re.IGNORECASE)
+_DIGITS_RE = re.compile(r'\d+')
+_OPT_RE = re.compile(r"(?:^|\s)[A-D]\)\s*([^;|\n]+)")
+_MC_LEAD_RE = re.compile(r"([A-Da-d])\b")
+_SENTENCE_SPLIT_RE = re.compile(r'(?<=[.!?])\s+')
+
+# Errors worth retrying: rate limits, timeouts, dropped connections and 5xx
+_TRANSIENT_API_ERRORS = (
+    openai.RateLimitError,
+    openai.APITimeoutError,
+    openai.APIConnectionError,
+    openai.InternalServerError,
+)
+
+_VALID_TYPES = frozenset({"multiple_choice", "true_false", "short_answer"})
+
+# Output budget per question by type, plus a fixed allowance for the title/wrapper.
+# Sized with headroom over typical output so long explanations are not cut off.
+_TOKENS_PER_QUESTION = {"multiple_choice": 180, "true_false": 100, "short_answer": 130}
+_RESPONSE_OVERHEAD_TOKENS = 60
+
+# Content budget sent to the model, estimated at ~4 characters per token
+_MAX_CONTENT_TOKENS = 5000
+_CHARS_PER_TOKEN = 4
+
+
+# One pooled HTTP/2 client per API key, shared across reruns and sessions
+@st.cache_resource(show_spinner=False)
+def _get_client(api_key: str) -> OpenAI:
+    return OpenAI(
+        base_url="https://openrouter.ai/api/v1",
+        api_key=api_key,
+        # Retries are handled by the tenacity decorator on _get_api_response
+        max_retries=0,
+        http_client=httpx.Client(
+            http2=True,
+            limits=httpx.Limits(max_connections=16, max_keepalive_connections=8),
+            timeout=httpx.Timeout(60.0, connect=5.0)
+        )
+    )
+
+
+class _IncompleteQuiz(Exception):
+    """Raised out of the quiz cache so a short or empty quiz is returned but not cached."""
+    def __init__(self, quiz: Dict[str, Any]):
+        super().__init__("quiz has fewer questions than requested")
+        self.quiz = quiz
+
+
+# Cached quiz generation, keyed on the content hash and quiz settings (the
+# underscore-prefixed generator and content are not hashed by Streamlit).
+# st.cache_data does not store exceptions, so incomplete quizzes are retried next time.
+@st.cache_data(ttl=3600, max_entries=128, show_spinner=False)
+def _generate_quiz_cached(_generator, _content: str, content_hash: str, quiz_type: str, num_questions: int, difficulty: str) -> Dict[str, Any]:
+    quiz = _generator._generate_quiz_uncached(_content, quiz_type, num_questions, difficulty)
+    if len(quiz.get("questions") or []) < num_questions:
+        raise _IncompleteQuiz(quiz)
+    return quiz
+
+
 # Defines the quiz generator class
 class QuizGenerator:
     def __init__(self):
@@ -19,10 +100,7 @@ class QuizGenerator:
             st.info("🆓 Get one at https://openrouter.ai")
             st.stop()
 
-        self.client = OpenAI(
-            base_url="https://openrouter.ai/api/v1",
-            api_key=openrouter_key
-        )
+        self.client = _get_client(openrouter_key)
         self.model = "anthropic/claude-3-haiku"
 
     # Generate quiz with AI
@@ -30,13 +108,22 @@ class QuizGenerator:
         """Always returns {'title': str, 'questions': [ ... ]}."""
         quiz_type = self._normalize_quiz_type(quiz_type)
         content = self._preprocess_content(content)
+        content_hash = hashlib.blake2b(content.encode(), digest_size=16).hexdigest()
+        try:
+            return _generate_quiz_cached(self, content, content_hash, quiz_type, num_questions, difficulty)
+        except _IncompleteQuiz as e:
+            return e.quiz
 
+    def _generate_quiz_uncached(self, content: str, quiz_type: str, num_questions: int, difficulty: str) -> Dict[str, Any]:
+        # Schema + content, built once and shared by every request for this quiz
+        prefix = self._stable_prefix(content)
         if quiz_type == "mixed":
-            return self._generate_mixed_quiz(content, num_questions, difficulty)
+            return self._generate_mixed_quiz(prefix, num_questions, difficulty)
 
-        prompt = self._create_prompt(content, quiz_type, num_questions, difficulty)
-        raw = self._get_api_response(prompt)
-        data = self._parse_response_strict(raw)
+        if num_questions >= 8:
+            data = self._generate_quiz_sharded(prefix, quiz_type, num_questions, difficulty)
+        else:
+            data = self._request_quiz(prefix, quiz_type, num_questions, difficulty)
 
         # Final shape & type tagging
         title = data.get("title") or "Study Quiz"
@@ -48,6 +135,49 @@ class QuizGenerator:
                 out["questions"].append(self._ensure_question_fields(q, quiz_type))
         return out
 
+    def _request_quiz(self, prefix: str, quiz_type: str, num_questions: int, difficulty: str,
+                      part: Optional[Tuple[int, int]] = None) -> Dict[str, Any]:
+        prompt = self._create_prompt(prefix, quiz_type, num_questions, difficulty, part)
+        raw = self._get_api_response(prompt, self._estimate_max_tokens(quiz_type, num_questions))
+        return self._parse_response_strict(raw)
+
+    def _generate_quiz_sharded(self, prefix: str, quiz_type: str, num_questions: int, difficulty: str, shard: int = 4) -> Dict[str, Any]:
+        """Split a large quiz into shards of `shard` questions requested concurrently, then merge.
+
+        Each shard is pointed at its own part of the content so the shards don't
+        repeat each other; if duplicates still leave the quiz short, one top-up
+        request covering the whole content fills the gap.
+        """
+        sizes = [min(shard, num_questions - start) for start in range(0, num_questions, shard)]
+        futures = [
+            _API_POOL.submit(self._request_quiz, prefix, quiz_type, size, difficulty, (i + 1, len(sizes)))
+            for i, size in enumerate(sizes)
+        ]
+
+        title = None
+        questions: List[Dict[str, Any]] = []
+        seen = set()
+
+        def merge(data: Dict[str, Any]) -> None:
+            for q in data.get("questions") or []:
+                if not isinstance(q, dict) or len(questions) >= num_questions:
+                    continue
+                key = str(q.get("question") or "").strip().lower()
+                if key in seen:
+                    continue
+                seen.add(key)
+                questions.append(q)
+
+        for future in futures:
+            data = future.result()
+            title = title or data.get("title")
+            merge(data)
+
+        missing = num_questions - len(questions)
+        if missing > 0:
+            merge(self._request_quiz(prefix, quiz_type, missing, difficulty))
+        return {"title": title or "Study Quiz", "questions": questions}
+
     # Helper functions
     def _normalize_quiz_type(self, t: str) -> str:
         m = {
@@ -59,14 +189,36 @@ class QuizGenerator:
         return m.get(t, t).lower()
     # Checks if content is too long
     def _preprocess_content(self, content: str) -> str:
-        content = re.sub(r'\s+', ' ', content).strip()
-        content = content.encode('ascii', 'ignore').decode('ascii')
-        if len(content) > 20000:
-            content = content[:20000]
-            st.warning("⚠️ Content truncated to 20,000 characters.")
+        content = _WS_RE.sub(' ', content).strip()
+        # Most notes are already ASCII; only pay for the strip when they are not
+        if not content.isascii():
+            content = content.encode('ascii', 'ignore').decode('ascii')
+        # Drop repeated sentences (pasted notes often repeat headings and definitions)
+        seen = set()
+        sentences = []
+        for sentence in _SENTENCE_SPLIT_RE.split(content):
+            key = sentence.lower()
+            if key not in seen:
+                seen.add(key)
+                sentences.append(sentence)
+        content = ' '.join(sentences)
+        max_chars = _MAX_CONTENT_TOKENS * _CHARS_PER_TOKEN
+        if len(content) > max_chars:
+            content = content[:max_chars]
+            st.warning(f"⚠️ Content truncated to about {_MAX_CONTENT_TOKENS:,} tokens.")
         return content
      # Generates prompt based on quiz type
-    def _create_prompt(self, content: str, quiz_type: str, num_questions: int, difficulty: str) -> str:
+    def _create_prompt(self, prefix: str, quiz_type: str, num_questions: int, difficulty: str,
+                       part: Optional[Tuple[int, int]] = None) -> Tuple[str, str]:
+        """
+        Returns (stable, volatile). The stable part (schema + content, from _stable_prefix)
+        is identical for every request on the same content so the provider can cache it;
+        only the short task line changes between requests.
+        """
+        return prefix, self._volatile_task(quiz_type, num_questions, difficulty, part)
+
+    def _stable_prefix(self, content: str) -> str:
+        """Schema + content, built once per quiz and shared by every shard."""
         base = (
             "You are a quiz generator. Output ONLY a single JSON object. "
             "NO markdown, NO code fences, NO comments. The JSON schema is:\n"
@@ -75,6 +227,10 @@ class QuizGenerator:
             '"correct_answer": "A|B|C|D or exact text or True/False", '
             '"explanation": "string" } ] }\n'
         )
+        return f"{base}\nContent:\n{content}\n"
+
+    def _volatile_task(self, quiz_type: str, num_questions: int, difficulty: str,
+                       part: Optional[Tuple[int, int]] = None) -> str:
         if quiz_type == "multiple_choice":
             task = f"Create {num_questions} {difficulty} multiple choice questions from this content. " \
                    f"Each must have options A-D, exactly one correct answer (letter or exact text), and an explanation."
@@ -84,21 +240,90 @@ class QuizGenerator:
         else:  # short_answer
             task = f"Create {num_questions} {difficulty} short answer questions from this content. " \
                    f"Include a clear correct_answer and an explanation."
+        if part:
+            # Sharded requests each cover a different slice so their questions don't overlap
+            index, total = part
+            task += f" Split the content into {total} equal consecutive parts and only use part {index} of {total}."
+        return task
 
-        return f"{base}\n{task}\nContent:\n{content}"
+    def _estimate_max_tokens(self, quiz_type: str, num_questions: int) -> int:
+        per_question = _TOKENS_PER_QUESTION.get(quiz_type, _TOKENS_PER_QUESTION["multiple_choice"])
+        return per_question * num_questions + _RESPONSE_OVERHEAD_TOKENS
 
-    def _get_api_response(self, prompt: str) -> str:
+    @retry(
+        stop=stop_after_attempt(3),
+        wait=wait_exponential_jitter(initial=0.5, max=2.0),
+        retry=retry_if_exception_type(_TRANSIENT_API_ERRORS),
+        reraise=True
+    )
+    def _get_api_response(self, prompt: Tuple[str, str], max_tokens: int = 2000) -> str:
+        stable, volatile = prompt
         resp = self.client.chat.completions.create(
             model=self.model,
             messages=[
-                {"role": "system", "content": "Return ONLY valid JSON as specified. No prose."},
-                {"role": "user", "content": prompt}
+                {"role": "system", "content": [
+                    {"type": "text", "text": "Return ONLY valid JSON as specified. No prose.",
+                     "cache_control": {"type": "ephemeral"}}
+                ]},
+                {"role": "user", "content": [
+                    {"type": "text", "text": stable, "cache_control": {"type": "ephemeral"}},
+                    {"type": "text", "text": volatile}
+                ]}
             ],
             temperature=0.5,
-            max_tokens=2000,
-            response_format={"type": "json_object"}
+            max_tokens=max_tokens,
+            response_format={"type": "json_object"},
+            stream=True
         )
-        return resp.choices[0].message.content or ""
+        # Stop reading once a complete top-level JSON value holding the questions is closed;
+        # anything else (a bracketed preamble, a partial array) keeps the stream going
+        buf = io.StringIO()
+        depth = pos = start = 0
+        in_string = escaped = False
+        try:
+            for chunk in resp:
+                if not chunk.choices:
+                    continue
+                piece = chunk.choices[0].delta.content or ""
+                buf.write(piece)
+                done = False
+                for ch in piece:
+                    pos += 1
+                    if depth == 0:
+                        # Not inside a value yet: wait for the first '{' or '['
+                        if ch in "{[":
+                            depth = 1
+                            start = pos - 1
+                        continue
+                    if in_string:
+                        if escaped:
+                            escaped = False
+                        elif ch == "\\":
+                            escaped = True
+                        elif ch == '"':
+                            in_string = False
+                    elif ch == '"':
+                        in_string = True
+                    elif ch in "{[":
+                        depth += 1
+                    elif ch in "}]":
+                        depth -= 1
+                        if depth == 0 and self._holds_questions(buf.getvalue()[start:pos]):
+                            done = True
+                            break
+                if done:
+                    break
+        finally:
+            resp.close()
+        return buf.getvalue()
+
+    def _holds_questions(self, text: str) -> bool:
+        """True if text parses as a question array or an object with a 'questions' list."""
+        try:
+            obj = _json_loads(text)
+        except Exception:
+            return False
+        return isinstance(obj, list) or (isinstance(obj, dict) and isinstance(obj.get("questions"), list))
 
     # Json handling
     def _parse_response_strict(self, response: str) -> Dict[str, Any]:
@@ -110,18 +335,25 @@ class QuizGenerator:
         Raises on totally invalid.
         """
         text = response.strip()
-        text = re.sub(r'^```(?:json)?\s*|\s*```$', '', text, flags=re.IGNORECASE)
 
         # First try: parse as JSON directly
         obj: Any
         try:
-            obj = json.loads(text)
+            obj = _json_loads(text)
         except Exception:
-            # Try to extract a JSON object or array substring
-            m = re.search(r'(\{.*\}|\[.*\])', text, flags=re.DOTALL)
-            if not m:
-                raise ValueError("Model did not return JSON.")
-            obj = json.loads(m.group(1))
+            # Locate the first balanced JSON object/array (this also skips code fences)
+            span = self._find_json_span(text)
+            try:
+                if span is None:
+                    raise ValueError("no balanced JSON span")
+                obj = _json_loads(text[span[0]:span[1] + 1])
+            except Exception:
+                # Defensive fallback: the original fence strip + greedy regex
+                text = _FENCE_RE.sub('', text)
+                m = _JSON_EXTRACT_RE.search(text)
+                if not m:
+                    raise ValueError("Model did not return JSON.")
+                obj = _json_loads(m.group(1))
 
         # If it's a list, wrap it
         if isinstance(obj, list):
@@ -131,9 +363,9 @@ class QuizGenerator:
             raise ValueError("Model returned non-object JSON.")
 
         if "questions" not in obj or not isinstance(obj.get("questions"), list):
-            q_keys = [k for k in obj.keys() if re.match(r'Q\d+', str(k), re.IGNORECASE)]
+            q_keys = [k for k in obj.keys() if _QKEY_RE.match(str(k))]
             if q_keys:
-                q_list = [obj[k] for k in sorted(q_keys, key=lambda x: int(re.findall(r'\d+', x)[0]))]
+                q_list = [obj[k] for k in sorted(q_keys, key=lambda x: int(_DIGITS_RE.findall(x)[0]))]
                 obj = {"title": obj.get("title", "Study Quiz"), "questions": q_list}
 
         # Ensure 'questions' exists
@@ -142,8 +374,39 @@ class QuizGenerator:
 
         return obj
 
+    def _find_json_span(self, text: str) -> Optional[Tuple[int, int]]:
+        """
+        Single scan for the first top-level JSON object/array, respecting string
+        literals. Returns inclusive (start, end) indices, or None if unbalanced.
+        """
+        start = -1
+        depth = 0
+        in_string = escaped = False
+        for i, ch in enumerate(text):
+            if start < 0:
+                if ch == "{" or ch == "[":
+                    start = i
+                    depth = 1
+                continue
+            if in_string:
+                if escaped:
+                    escaped = False
+                elif ch == "\\":
+                    escaped = True
+                elif ch == '"':
+                    in_string = False
+            elif ch == '"':
+                in_string = True
+            elif ch == "{" or ch == "[":
+                depth += 1
+            elif ch == "}" or ch == "]":
+                depth -= 1
+                if depth == 0:
+                    return start, i
+        return None
+
     # Mixed quiz generation
-    def _generate_mixed_quiz(self, content: str, num_questions: int, difficulty: str) -> Dict[str, Any]:
+    def _generate_mixed_quiz(self, prefix: str, num_questions: int, difficulty: str) -> Dict[str, Any]:
         """
         Generate a mixed quiz and ALWAYS return {'title': ..., 'questions': [...] }.
         """
@@ -153,64 +416,77 @@ class QuizGenerator:
             ("short_answer", 0.2)
         ]
 
+        # Decide the type mix up front, then make one request per type in parallel
+        type_counts = Counter(random.choices(
+            [t[0] for t in question_types],
+            weights=[t[1] for t in question_types],
+            k=num_questions
+        ))
+        futures = {
+            chosen_type: _API_POOL.submit(self._generate_typed_questions, prefix, chosen_type, count, difficulty)
+            for chosen_type, count in type_counts.items()
+        }
+
         questions: List[Dict[str, Any]] = []
+        for chosen_type, future in futures.items():
+            questions.extend(future.result())
+        random.shuffle(questions)
 
-        for _ in range(num_questions):
-            chosen_type = random.choices(
-                [t[0] for t in question_types],
-                weights=[t[1] for t in question_types],
-                k=1
-            )[0]
-
-            # Ask for ONE question of the chosen type
-            prompt = self._create_prompt(content, chosen_type, 1, difficulty)
-            raw = self._get_api_response(prompt)
-            data = self._parse_response_strict(raw)
-            qlist = data.get("questions", [])
-            if qlist:
-                q = qlist[0] if isinstance(qlist[0], dict) else {}
+        return {"title": "Mixed Quiz", "questions": questions}
+
+    def _generate_typed_questions(self, prefix: str, chosen_type: str, count: int, difficulty: str) -> List[Dict[str, Any]]:
+        """Ask for `count` questions of one type and return at most that many, normalized."""
+        prompt = self._create_prompt(prefix, chosen_type, count, difficulty)
+        raw = self._get_api_response(prompt, self._estimate_max_tokens(chosen_type, count))
+        data = self._parse_response_strict(raw)
+        questions = []
+        for q in data.get("questions", [])[:count]:
+            if isinstance(q, dict):
                 q["type"] = chosen_type
                 questions.append(self._ensure_question_fields(q, chosen_type))
-
-        return {"title": "Mixed Quiz", "questions": questions}
+        return questions
 
     # Ensure question fields & types
     def _ensure_question_fields(self, q: Dict[str, Any], fallback_type: str) -> Dict[str, Any]:
-        qtype = (q.get("type") or fallback_type or "").lower()
-        if qtype not in ("multiple_choice", "true_false", "short_answer"):
+        qtype = (q.get("type") or fallback_type or "short_answer").lower()
+        if qtype not in _VALID_TYPES:
             qtype = "short_answer"
         q["type"] = qtype
 
-        q["question"] = (q.get("question") or "").strip()
+        question = (q.get("question") or "").strip()
+        q["question"] = question
         q["explanation"] = q.get("explanation", "")
-        if "correct_answer" not in q or q.get("correct_answer") in (None, ""):
-            q["correct_answer"] = ""
+        # Keep falsy non-empty answers such as a JSON `false` for true/false questions
+        correct = q.get("correct_answer")
+        if correct is None or correct == "":
+            correct = q["correct_answer"] = ""
 
+        opts = q.get("options")
         if qtype == "multiple_choice":
-            opts = q.get("options", [])
-            if not isinstance(opts, list) or not opts:
-                opts = self._extract_options_from_text(q.get("question", ""))
+            if not opts or not isinstance(opts, list):
+                opts = self._extract_options_from_text(question)
             q["options"] = opts
-            q["correct_answer"] = self._normalize_mc_correct(q.get("correct_answer", ""), opts)
+            q["correct_answer"] = self._normalize_mc_correct(correct, opts)
         else:
-            q["options"] = q.get("options", [])
+            q["options"] = opts or []
 
         return q
 
     def _extract_options_from_text(self, text: str) -> List[str]:
         if not text:
             return []
-        matches = re.findall(r"(?:^|\s)[A-D]\)\s*([^;|\n]+)", text)
+        matches = _OPT_RE.findall(text)
         return [m.strip() for m in matches] if matches else []
 
     def _normalize_mc_correct(self, correct: Any, options: List[str]) -> str:
         c = str(correct).strip() if correct is not None else ""
-        if re.fullmatch(r"[A-Da-d]", c):
+        if len(c) == 1 and c in "ABCDabcd":
             return c.upper()
-        for idx, opt in enumerate(options):
-            if c.lower() == str(opt).strip().lower():
-                return opt
-        m = re.match(r"([A-Da-d])\b", c)
+        cl = c.lower()
+        opts_lower = [str(opt).strip().lower() for opt in options]
+        if cl in opts_lower:
+            return options[opts_lower.index(cl)]
+        m = _MC_LEAD_RE.match(c)
         if m:
             return m.group(1).upper()
         return c
@@ -228,9 +504,52 @@ class QuizGenerator:
                     {"role": "user", "content": prompt}
                 ],
                 temperature=0.0,
-                max_tokens=3
+                max_tokens=3,
+                stream=True
             )
-            ans = (resp.choices[0].message.content or "").strip().lower()
+            # The verdict is decided by the first letter, so stop reading there
+            ans = ""
+            try:
+                for chunk in resp:
+                    if not chunk.choices:
+                        continue
+                    ans = (chunk.choices[0].delta.content or "").strip().lower()
+                    if ans:
+                        break
+            finally:
+                resp.close()
             return "true" if ans.startswith("t") else "false" if ans.startswith("f") else "false"
         except Exception:
             return "false"
+
+    def grade_short_answers(self, prompts: List[str]) -> List[str]:
+        """
+        Judge several grading prompts in one request. Returns 'true' / 'false' per prompt, in order.
+        """
+        if not prompts:
+            return []
+        if len(prompts) == 1:
+            return [self.grade_short_answer(prompts[0])]
+        joined = "\n\n".join(f"[{i}] {p}" for i, p in enumerate(prompts))
+        try:
+            resp = self.client.chat.completions.create(
+                model=self.model,
+                messages=[
+                    {"role": "system", "content": (
+                        'Return ONLY a JSON object {"results": [...]} where results holds one '
+                        "'true' or 'false' string per numbered prompt, in order."
+                    )},
+                    {"role": "user", "content": joined}
+                ],
+                temperature=0.0,
+                max_tokens=8 * len(prompts) + 20,
+                response_format={"type": "json_object"}
+            )
+            data = _json_loads(resp.choices[0].message.content or "{}")
+            results = data.get("results") if isinstance(data, dict) else data
+            if not isinstance(results, list):
+                results = []
+        except Exception:
+            results = []
+        verdicts = ["true" if str(r).strip().lower().startswith("t") else "false" for r in results[:len(prompts)]]
+        return verdicts + ["false"] * (len(prompts) - len(verdicts))
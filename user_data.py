@@ -2,9 +2,17 @@
 # Page name: user_data.py
 # Page purpose: User data management for app.py
 # Date of creation: 2025-10-10
+import atexit
+import functools
 import hashlib
+import hmac
+import json
+import os
+import uuid
+from concurrent.futures import ThreadPoolExecutor
 from datetime import datetime
 from typing import List, Dict, Optional, Tuple
+import httpx
 import streamlit as st
 from supabase import create_client
 
@@ -12,34 +20,105 @@ from supabase import create_client
 SUPABASE_URL = st.secrets["SUPABASE_URL"]
 SUPABASE_KEY = st.secrets["SUPABASE_KEY"]
 ADMIN_KEY = st.secrets.get("ADMIN_KEY", "")
-supabase = create_client(SUPABASE_URL, SUPABASE_KEY)
+
+# One client per server process, reruns reuse it and its pooled HTTP/2 session
+@st.cache_resource(show_spinner=False)
+def get_supabase():
+    client = create_client(SUPABASE_URL, SUPABASE_KEY)
+    session = client.postgrest.session
+    client.postgrest.session = httpx.Client(
+        base_url=session.base_url,
+        headers=session.headers,
+        timeout=session.timeout,
+        http2=True,
+        limits=httpx.Limits(max_connections=10, max_keepalive_connections=10)
+    )
+    session.close()
+    atexit.register(client.postgrest.session.close)
+    return client
+
+supabase = get_supabase()
+
+# Rows per bulk write, keeps each POST well under PostgREST payload limits
+BULK_BATCH_SIZE = 50
+
+# Shared pool for independent per-table requests, sized within Supabase's connection pool
+_IO_POOL = ThreadPoolExecutor(max_workers=8)
+
+_DATA_TABLES = ("notes", "flashcards", "study_sessions", "events")
+
+# Only the columns load_user_data hands back to the app
+_LOAD_COLUMNS = {
+    "notes": "id,title,content,category,created_at",
+    "flashcards": "id,front,back,category,created_at",
+    "study_sessions": "id,data,timestamp,activity_type",
+    "events": "id,name,date,notes,color,created_at",
+}
 
 # Core functions
 def _now_iso() -> str:
     """Get current UTC timestamp"""
     return datetime.utcnow().isoformat()
-# Password hasher
+
+def _chunks(seq: list, n: int = BULK_BATCH_SIZE):
+    for i in range(0, len(seq), n):
+        yield seq[i:i + n]
+
+def _select_user_rows(username: str, tables=_DATA_TABLES,
+                      columns: Optional[Dict[str, str]] = None) -> Dict[str, list]:
+    """Fetch every table's rows for a user concurrently, returns {table: rows}"""
+    columns = columns or {}
+    futures = {
+        table: _IO_POOL.submit(supabase.table(table).select(columns.get(table, "*")).eq("username", username).execute)
+        for table in tables
+    }
+    return {table: f.result().data or [] for table, f in futures.items()}
+
+# Wipes notes, flashcards, study_sessions and events for a user in one transaction,
+# via the delete_user_data(u text) Postgres function
+def _delete_user_data(username: str) -> None:
+    supabase.rpc("delete_user_data", {"u": username}).execute()
+
+# scrypt cost: n=2**14, r=8 is ~16 MB of memory per hash
+_SCRYPT_N = 2 ** 14
+_SCRYPT_R = 8
+_SCRYPT_P = 1
+
+def _scrypt_hex(password: str, salt: bytes) -> str:
+    return hashlib.scrypt(password.encode("utf-8"), salt=salt,
+                          n=_SCRYPT_N, r=_SCRYPT_R, p=_SCRYPT_P).hex()
+
+# Password hasher, stored as "<salt hex>:<scrypt hex>"
 def hash_password(password: str) -> str:
-    return hashlib.sha256(password.encode("utf-8")).hexdigest()
-# convert username to lowercase
+    salt = os.urandom(16)
+    return salt.hex() + ":" + _scrypt_hex(password, salt)
+
+# Check a password against a stored hash, including legacy unsalted sha256 ones
+def verify_password(password: str, stored: str) -> bool:
+    if ":" not in stored:
+        legacy = hashlib.sha256(password.encode("utf-8")).hexdigest()
+        return hmac.compare_digest(legacy, stored)
+    salt_hex, digest_hex = stored.split(":", 1)
+    return hmac.compare_digest(_scrypt_hex(password, bytes.fromhex(salt_hex)), digest_hex)
+
+# Stand-in hash for unknown usernames in authenticate
+_DUMMY_HASH = hash_password("")
+
+# convert username to lowercase, memoized since reruns pass the same names
+@functools.lru_cache(maxsize=256)
 def normalize_username(username: str) -> str:
     return username.strip().lower()
 
 def admin_delete_account(target_username: str) -> Tuple[bool, str]:
     normalized = normalize_username(target_username)
     try:
-        # Check if user exists
-        user_check = supabase.table("users").select("username").eq("username", normalized).execute()
-        if not user_check.data:
-            return False, "User does not exist"
-
-        # Delete all user data first
-        tables = ["notes", "flashcards", "study_sessions", "events"]
-        for table in tables:
-            supabase.table(table).delete().eq("username", normalized).execute()
+        # Delete all user data first, a no-op for unknown users
+        _delete_user_data(normalized)
 
-        # Delete the user
-        supabase.table("users").delete().eq("username", normalized).execute()
+        # Delete the user, the returned rows tell us whether it existed
+        deleted = supabase.table("users").delete().eq("username", normalized).execute()
+        if not deleted.data:
+            return False, "User does not exist"
 
         return True, "User account and data deleted successfully"
     except Exception as e:
@@ -53,16 +132,7 @@ def register_user(username: str, password: str) -> Tuple[bool, str]:
         return False, "Username and password required"
     
     try:
-        # Check for existing username
-        existing = supabase.table("users") \
-                         .select("username") \
-                         .eq("username", normalized) \
-                         .execute()
-        
-        if existing.data:
-            return False, "Username already exists"
-            
-        # Insert new user
+        # Insert new user, the users_username_key constraint (migrations/001) rejects duplicates
         supabase.table("users").insert({
             "username": normalized,
             "password": hash_password(password),
@@ -71,38 +141,41 @@ def register_user(username: str, password: str) -> Tuple[bool, str]:
         
         return True, "Registration successful"
     except Exception as e:
+        # 23505 is Postgres' unique_violation
+        if getattr(e, "code", None) == "23505":
+            return False, "Username already exists"
         return False, f"Registration failed: {str(e)}"
 
 def authenticate(username: str, password: str) -> Tuple[bool, str]:
     """Login with case-insensitive username"""
     normalized = normalize_username(username)
     try:
-        # Find user
+        # Find user, only the stored hash is needed
         user = supabase.table("users") \
-                     .select("*") \
+                     .select("password") \
                      .eq("username", normalized) \
+                     .limit(1) \
                      .execute()
-        
-        if not user.data:
-            return False, "User not found"
-            
-        # Verify password
-        if user.data[0]["password"] == hash_password(password):
+
+        # Verify password, unknown users are checked against a dummy hash so
+        # both failures take the same time and give the same answer
+        stored = user.data[0]["password"] if user.data else _DUMMY_HASH
+        if verify_password(password, stored) and user.data:
+            # Upgrade legacy sha256 hashes on the first successful login
+            if ":" not in stored:
+                supabase.table("users").update({"password": hash_password(password)}).eq("username", normalized).execute()
             return True, "Login successful"
-        return False, "Incorrect password"
+        return False, "Invalid credentials"
     except Exception as e:
         return False, f"Login error: {str(e)}"
 
 def admin_reset_password(target_username: str, new_password: str) -> Tuple[bool, str]:
     normalized = normalize_username(target_username)
     try:
-        # Check if user exists first
-        user_check = supabase.table("users").select("username").eq("username", normalized).execute()
-        if not user_check.data:
+        # Update password, no rows back means the user does not exist
+        updated = supabase.table("users").update({"password": hash_password(new_password)}).eq("username", normalized).execute()
+        if not updated.data:
             return False, "User does not exist"
-
-        # Proceed to update password
-        supabase.table("users").update({"password": hash_password(new_password)}).eq("username", normalized).execute()
         return True, "Password updated successfully"
     except Exception as e:
         return False, f"Reset failed: {str(e)}"
@@ -113,12 +186,7 @@ def delete_account(username: str) -> Tuple[bool, str]:
     normalized = normalize_username(username)
     try:
         # Delete user data first
-        tables = ["notes", "flashcards", "study_sessions", "events"]
-        for table in tables:
-            supabase.table(table) \
-                  .delete() \
-                  .eq("username", normalized) \
-                  .execute()
+        _delete_user_data(normalized)
         
         # Delete user
         supabase.table("users") \
@@ -131,6 +199,88 @@ def delete_account(username: str) -> Tuple[bool, str]:
         return False, f"Deletion failed: {str(e)}"
 
 # Data handling functions
+# session_state key for the per-table {row id: hash} maps from the last successful save
+_SAVED_HASHES_KEY = "_saved_row_hashes"
+
+def _item_id(item: dict) -> str:
+    """Stable row id, stored on the item so later saves upsert the same row"""
+    if not item.get("id"):
+        item["id"] = str(uuid.uuid4())
+    return item["id"]
+
+# Change detection only, hashlib's OpenSSL sha256 already uses SHA-NI where the CPU has it
+def _item_hash(item: dict) -> str:
+    return hashlib.sha256(json.dumps(item, sort_keys=True, default=str).encode("utf-8")).hexdigest()
+
+def _note_row(username: str, n: dict) -> dict:
+    return {
+        "id": n["id"],
+        "username": username,
+        "title": n.get("title"),
+        "content": n.get("content"),
+        "category": n.get("category", "General"),
+        "created_at": n.get("timestamp") or _now_iso(),
+        "updated_at": n.get("timestamp") or _now_iso()
+    }
+
+def _flashcard_row(username: str, c: dict) -> dict:
+    return {
+        "id": c["id"],
+        "username": username,
+        "front": c.get("front"),
+        "back": c.get("back"),
+        "category": c.get("category", "General"),
+        "created_at": c.get("created") or _now_iso()
+    }
+
+def _study_session_row(username: str, s: dict) -> dict:
+    return {
+        "id": s["id"],
+        "username": username,
+        "timestamp": s.get("timestamp") or _now_iso(),
+        "activity_type": s.get("activity_type"),
+        "data": s
+    }
+
+def _event_row(username: str, e: dict) -> dict:
+    return {
+        "id": e["id"],
+        "username": username,
+        "name": e.get("name"),
+        "date": e.get("date"),
+        "notes": e.get("notes"),
+        "color": e.get("color"),
+        "created_at": e.get("created") or _now_iso()
+    }
+
+def _sync_table(table: str, username: str, items: List[dict], build_row,
+                saved: Optional[Dict[str, str]]) -> Dict[str, str]:
+    """Upsert changed rows and delete removed ones, returns the new {id: hash} map"""
+    hashes = {}
+    changed = []
+    for item in items:
+        row_id = _item_id(item)
+        h = _item_hash(item)
+        hashes[row_id] = h
+        if saved is None or saved.get(row_id) != h:
+            changed.append(build_row(username, item))
+
+    if saved is None and not hashes:
+        # Saves follow a load, so an empty table here was empty on the server too
+        return hashes
+    if saved is None:
+        # No baseline yet, so ask the server which ids it holds and clear the ones this session doesn't
+        server_ids = supabase.table(table).select("id").eq("username", username).execute().data or []
+        removed = [row["id"] for row in server_ids if row["id"] not in hashes]
+    else:
+        removed = [row_id for row_id in saved if row_id not in hashes]
+    for batch in _chunks(removed):
+        supabase.table(table).delete().eq("username", username).in_("id", batch).execute()
+
+    for batch in _chunks(changed):
+        supabase.table(table).upsert(batch, on_conflict="username,id").execute()
+    return hashes
+
 def save_current_user(session_state: dict) -> Tuple[bool, str]:
     if not session_state.get("logged_in"):
         return False, "Not logged in"
@@ -138,63 +288,21 @@ def save_current_user(session_state: dict) -> Tuple[bool, str]:
     normalized = normalize_username(session_state["username"])
     
     try:
-        # NOTES
-        supabase.table("notes").delete().eq("username", normalized).execute()
-        notes_to_insert = []
-        for n in session_state.get("notes", []):
-            notes_to_insert.append({
-                "username": normalized,
-                "title": n.get("title"),
-                "content": n.get("content"),
-                "category": n.get("category", "General"),
-                "created_at": n.get("timestamp") or _now_iso(),
-                "updated_at": n.get("timestamp") or _now_iso()
-            })
-        if notes_to_insert:
-            supabase.table("notes").insert(notes_to_insert).execute()
-
-        # FLASHCARDS
-        supabase.table("flashcards").delete().eq("username", normalized).execute()
-        fcs = []
-        for c in session_state.get("flashcards", []):
-            fcs.append({
-                "username": normalized,
-                "front": c.get("front"),
-                "back": c.get("back"),
-                "category": c.get("category", "General"),
-                "created_at": c.get("created") or _now_iso()
-            })
-        if fcs:
-            supabase.table("flashcards").insert(fcs).execute()
-
-        # STUDY SESSIONS
-        supabase.table("study_sessions").delete().eq("username", normalized).execute()
-        ss = []
-        for s in session_state.get("study_sessions", []):
-            ss.append({
-                "username": normalized,
-                "timestamp": s.get("timestamp") or _now_iso(),
-                "activity_type": s.get("activity_type"),
-                "data": s
-            })
-        if ss:
-            supabase.table("study_sessions").insert(ss).execute()
-
-        # EVENTS
-        supabase.table("events").delete().eq("username", normalized).execute()
-        events = []
-        for e in session_state.get("events", []):
-            events.append({
-                "username": normalized,
-                "name": e.get("name"),      
-                "date": e.get("date"),     
-                "notes": e.get("notes"),
-                "color": e.get("color"),
-                "created_at": e.get("created") or _now_iso()
-            })
-        if events:
-            supabase.table("events").insert(events).execute()
+        saved = session_state.get(_SAVED_HASHES_KEY)
+        if not saved or saved.get("username") != normalized:
+            saved = {"username": normalized}
+
+        # Each table's deletes and upserts stay ordered, the tables run side by side
+        futures = {
+            table: _IO_POOL.submit(_sync_table, table, normalized, session_state.get(table, []),
+                                   build_row, saved.get(table))
+            for table, build_row in (("notes", _note_row), ("flashcards", _flashcard_row),
+                                     ("study_sessions", _study_session_row), ("events", _event_row))
+        }
+        for table, f in futures.items():
+            saved[table] = f.result()
 
+        session_state[_SAVED_HASHES_KEY] = saved
         return True, "Data saved successfully"
     except Exception as e:
         return False, f"Save error: {str(e)}"
@@ -218,7 +326,8 @@ def change_password(username, new_password):
 def delete_account(username):
     """Deletes a user's account and all their data."""
     try:
-        # Delete the user's row from the 'users' table
+        # Delete the user's data, then their row in the 'users' table
+        _delete_user_data(username.lower())
         supabase.from_("users").delete().eq("username", username.lower()).execute()
         
         return True, "Account deleted successfully."
@@ -233,49 +342,18 @@ def load_user_data(username: str, merge_local: bool = False,
     """Load user data with case-insensitive lookup"""
     normalized = normalize_username(username)
     try:
-        # NOTES
-        r = supabase.table("notes").select("*").eq("username", normalized).execute()
-        notes = []
-        if r.data:
-            for row in r.data:
-                notes.append({
-                    "title": row.get("title"),
-                    "content": row.get("content"),
-                    "category": row.get("category"),
-                    "timestamp": row.get("created_at")
-                })
-
-        # FLASHCARDS
-        r = supabase.table("flashcards").select("*").eq("username", normalized).execute()
-        flashcards = []
-        if r.data:
-            for row in r.data:
-                flashcards.append({
-                    "front": row.get("front"),
-                    "back": row.get("back"),
-                    "category": row.get("category"),
-                    "created": row.get("created_at")
-                })
-
-        # STUDY SESSIONS
-        r = supabase.table("study_sessions").select("*").eq("username", normalized).execute()
+        rows = _select_user_rows(normalized, columns=_LOAD_COLUMNS)
+
+        # The projected rows already have the app's keys, bar the created_at rename
+        notes = [dict(row, timestamp=row.pop("created_at")) for row in rows["notes"]]
+        flashcards = [dict(row, created=row.pop("created_at")) for row in rows["flashcards"]]
+        events = [dict(row, created=row.pop("created_at")) for row in rows["events"]]
+
         study_sessions = []
-        if r.data:
-            for row in r.data:
-                study_sessions.append(row.get("data") or {"timestamp": row.get("timestamp"), "activity_type": row.get("activity_type")})
-
-        # EVENTS
-        r = supabase.table("events").select("*").eq("username", normalized).execute()
-        events = []
-        if r.data:
-            for row in r.data:
-                events.append({
-                    "name": row.get("name"),      # Check if your app uses 'name' or 'title'
-                    "date": row.get("date"),       # Check if your app uses 'date' or 'start'/'end'
-                    "notes": row.get("notes"),
-                    "color": row.get("color"),
-                    "created": row.get("created_at")
-                })
+        for row in rows["study_sessions"]:
+            session = row["data"] or {"timestamp": row["timestamp"], "activity_type": row["activity_type"]}
+            session["id"] = row["id"]
+            study_sessions.append(session)
 
         payload = {
             "notes": notes,
@@ -284,15 +362,23 @@ def load_user_data(username: str, merge_local: bool = False,
             "events": events  
         }
 
+        # Row hashes of what the server holds now, so the next save only sends real changes
+        baseline = {"username": normalized}
+        for key in _DATA_TABLES:
+            baseline[key] = {item["id"]: _item_hash(item) for item in payload[key]}
+
         if merge_local and local_state:
-            merged = {
-                "notes": local_state.get("notes", []) + payload["notes"],
-                "flashcards": local_state.get("flashcards", []) + payload["flashcards"],
-                "study_sessions": local_state.get("study_sessions", []) + payload["study_sessions"],
-                "events": local_state.get("events", []) + payload["events"] # <-- NOW MERGES EVENTS!
-            }
+            merged = {}
+            for key in _DATA_TABLES:
+                local = local_state.get(key, [])
+                # Server rows the local copy already holds (same id) are not added twice
+                local_ids = {item.get("id") for item in local}
+                local_ids.discard(None)
+                merged[key] = [*local, *(item for item in payload[key] if item["id"] not in local_ids)]
+            merged[_SAVED_HASHES_KEY] = baseline
             return True, merged
             
+        payload[_SAVED_HASHES_KEY] = baseline
         return True, payload
     except Exception as e:
         return False, {"error": str(e)}
@@ -300,28 +386,12 @@ def export_user_data(username: str) -> Tuple[bool, str, dict]:
     """Export all user data as JSON"""
     normalized = normalize_username(username)
     try:
-        # Get all user data
-        user_data = {}
-        
-        # NOTES
-        r = supabase.table("notes").select("*").eq("username", normalized).execute()
-        user_data["notes"] = r.data if r.data else []
-        
-        # FLASHCARDS
-        r = supabase.table("flashcards").select("*").eq("username", normalized).execute()
-        user_data["flashcards"] = r.data if r.data else []
-        
-        # STUDY SESSIONS
-        r = supabase.table("study_sessions").select("*").eq("username", normalized).execute()
-        user_data["study_sessions"] = r.data if r.data else []
-        
-        # EVENTS
-        r = supabase.table("events").select("*").eq("username", normalized).execute()
-        user_data["events"] = r.data if r.data else []
-        
-        # USER INFO
-        r = supabase.table("users").select("username, created_at").eq("username", normalized).execute()
-        user_data["user_info"] = r.data[0] if r.data else {}
+        # Get all user data, the export_all(u text) Postgres function builds
+        # notes, flashcards, study_sessions, events and user_info in one round trip
+        r = supabase.rpc("export_all", {"u": normalized}).execute()
+        exported = r.data or {}
+        user_data = {table: exported.get(table) or [] for table in _DATA_TABLES}
+        user_data["user_info"] = exported.get("user_info") or {}
         
         # Add export metadata
         user_data["export_metadata"] = {